@@ -1,8 +1,19 @@
 # Import libraries
+from collections import namedtuple
+from math import sqrt
+
 import streamlit as st
 import numpy as np
-import pandas as pd
-import matplotlib.pyplot as plt
+
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+try:
+    import numexpr as ne
+except ImportError:
+    ne = None
 
 st.set_page_config(
     page_title="Open-Channel Flow",
@@ -47,48 +58,154 @@ st.sidebar.header("Input parameters")
 with st.sidebar:
     st.title("Input Parameters")
     # Add all user inputs here
-    q = st.sidebar.slider("Discharge per unit width (q)", 0.0, 10.0, 5.0)
-    ho = st.sidebar.number_input("Channel bottom elevation (ho)", 0.0, 10.0, 5.0)
+    st.sidebar.slider("Discharge per unit width (q)", 0.0, 10.0, 5.0, key = "q_raw")
+    # Debounce: sub-threshold drags rerun the script but keep the last
+    # applied q, so the cached curve/flow/figure work is all hits.
+    if abs(st.session_state.q_raw - st.session_state.get("q_applied", float("inf"))) > 0.05:
+        st.session_state.q_applied = st.session_state.q_raw
+    q = st.session_state.q_applied
+    ho = st.sidebar.number_input("Channel bottom elevation (ho)", 0.01, 10.0, 5.0)
     delta_h = st.sidebar.slider("Change in channel bottom elevation (delta h)", -10.0, 10.0, 0.0)
 
-# Calculate specific head and depth
-d = np.linspace(0.01, 10, 100)
-Ho = q ** 2 / (2 * g * d ** 2) + d
-df = pd.DataFrame({"Depth": d, "Specific Head": Ho})
-
-# Calculate approaching and downstream flow properties
-d1 = ho + q ** 2 / (2 * g * ho ** 2)
-Ho1 = ho + d1
-Ho2 = Ho1 - delta_h
-d2 = np.interp(Ho2, df["Specific Head"], df["Depth"])
-
-# Calculate velocities and Froude numbers
-U1 = q / d1
-U2 = q / d2
-Fr1 = U1 / np.sqrt(g * d1)
-Fr2 = U2 / np.sqrt(g * d2)
+# Calculate specific head and depth. The Numba kernel fuses the ufunc
+# chain into a single pass with no temporary arrays; the first call pays
+# the JIT cost (amortized on disk by cache=True), and plain NumPy is the
+# fallback when numba is not installed.
+def _ho_curve(q, g, d):
+    out_h = np.empty_like(d)
+    for i in range(d.shape[0]):
+        di = d[i]
+        out_h[i] = q * q / (2 * g * di * di) + di
+    return out_h
+
+
+if njit is not None:
+    _ho_curve = njit(cache=True, fastmath=True)(_ho_curve)
+
+
+@st.cache_data
+def specific_head_curve(q, n=50):
+    # Sample log-spaced around the critical depth, where the curve bends
+    # hardest, instead of uniformly: the minimum comes out smooth with
+    # fewer points. Fall back to a uniform grid when d_c sits at the edge
+    # of the plotted range (q near zero). float32 is plenty for a curve
+    # that only ever feeds the plot; the scalar solves stay float64.
+    d_c = (q * q / g) ** (1.0 / 3.0)
+    if 0.02 < d_c < 9.99:
+        half = n // 2
+        left = d_c - np.geomspace(d_c - 0.01, 1e-3, half)
+        right = d_c + np.geomspace(1e-3, 10.0 - d_c, n - half)
+        d = np.concatenate((left, right))
+    else:
+        d = np.linspace(0.01, 10, n)
+    d = d.astype(np.float32)
+    if njit is not None:
+        return d, _ho_curve(q, g, d)
+    if ne is not None:
+        # numexpr fuses the whole expression into one C loop with no
+        # ufunc temporaries, like the Numba kernel but without JIT warmup
+        local = {"qsq": np.float32(q * q), "two_g": np.float32(2 * g), "d": d}
+        return d, ne.evaluate("qsq / (two_g * d * d) + d", local_dict=local)
+    return d, q * q / (2 * g * d * d) + d
+
+
+depths, Hos = specific_head_curve(q)
+
+# Critical flow is closed-form: d_c = (q^2/g)^(1/3) and H_c = 1.5 d_c,
+# so the critical point is annotated exactly rather than read off the
+# sampled minimum.
+d_c = (q * q / g) ** (1.0 / 3.0)
+H_c = 1.5 * d_c
+
+
+# Invert the specific head equation Ho = d + q^2/(2 g d^2), i.e. find the
+# roots of the cubic d^3 - Ho*d^2 + q^2/(2g) = 0 and pick the branch:
+# subcritical is the largest real root above the critical depth
+# d_c = (q^2/g)^(1/3), supercritical the root between 0 and d_c.
+def solve_depth(Ho, q, subcritical=True):
+    d_c = (q * q / g) ** (1 / 3)
+    roots = np.roots([1.0, -Ho, 0.0, q * q / (2 * g)])
+    real = roots[np.abs(roots.imag) < 1e-9].real
+    if subcritical:
+        branch = real[real >= d_c]
+        return float(branch.max()) if branch.size else d_c
+    branch = real[(real > 0) & (real <= d_c)]
+    return float(branch.min()) if branch.size else d_c
+
+
+# Calculate approaching and downstream flow properties, velocities and
+# Froude numbers. These are pure in (q, ho, delta_h), so the whole block
+# is memoized as one cached call.
+FlowState = namedtuple("FlowState", ["d1", "Ho1", "Ho2", "d2", "U1", "U2", "Fr1", "Fr2"])
+
+
+@st.cache_data
+def flow_state(q, ho, delta_h):
+    d1 = ho
+    Ho1 = d1 + q * q / (2 * g * d1 * d1)
+    Ho2 = Ho1 - delta_h
+    d2 = solve_depth(Ho2, q)
+    U1 = q / d1
+    # math.sqrt: these are plain floats, and the ufunc dispatch in
+    # np.sqrt costs more than the sqrt itself for scalars
+    Fr1 = U1 / sqrt(g * d1)
+    if d2 > 0:
+        U2 = q / d2
+        Fr2 = U2 / sqrt(g * d2)
+    else:
+        # q = 0 with the head stepped below zero leaves a dry downstream
+        # reach: no depth, no velocity
+        U2 = Fr2 = 0.0
+    return FlowState(d1, Ho1, Ho2, d2, U1, U2, Fr1, Fr2)
+
+
+d1, Ho1, Ho2, d2, U1, U2, Fr1, Fr2 = flow_state(q, ho, delta_h)
+
+
+# Plot channel figure. The Figure/Axes pair is created once and kept
+# alive by st.cache_resource; each rerun clears the axes and redraws the
+# artists instead of paying full figure construction again. Caching the
+# figure per parameter combination would instead leak one figure per
+# distinct slider position. The figures are built with the OO Figure API
+# rather than plt.subplots() so they never enter pyplot's global
+# registry, which keeps every figure it has seen alive.
+@st.cache_resource
+def _channel_fig():
+    # Deferred so the ~hundreds of ms of matplotlib import are paid on
+    # first figure creation, not at module import
+    from matplotlib.figure import Figure
+
+    fig = Figure()
+    ax = fig.add_subplot()
+    # Static layout belongs to the template: set once here, never redone
+    # on reruns, which only swap the data artists below.
+    ax.set_xlim(0, 3)
+    ax.set_xlabel("Horizontal distance")
+    ax.set_ylabel("Elevation")
+    ax.set_title("Channel Figure")
+    return fig, ax
 
 
-# Plot channel figure
 def plot_channel(ho1, delta_h, d1, d2):
-    fig, ax = plt.subplots()
+    fig, ax = _channel_fig()
+    for artist in list(ax.lines) + list(ax.collections):
+        artist.remove()
 
     x = [0, 1, 2, 3]
     y = [ho1, ho1, ho1 + delta_h, ho1 + delta_h]
 
     ax.plot(x, y, color = 'black', linewidth = 2)
 
-    # Approaching flow
-    ax.fill_between([0, 1], ho1, ho1 + d1, color = 'blue', alpha = 0.5)
-
-    # Downstream flow
-    ax.fill_between([2, 3], ho1 + delta_h, ho1 + delta_h + d2, color = 'blue', alpha = 0.5)
+    # Approaching and downstream flow in one collection; the masked-out
+    # midpoint breaks the fill across the step so the two water bodies
+    # stay separate rectangles.
+    xw = np.array([0, 1, 1.5, 2, 3])
+    bottom = np.array([ho1, ho1, 0, ho1 + delta_h, ho1 + delta_h])
+    top = bottom + np.array([d1, d1, 0, d2, d2])
+    ax.fill_between(xw, bottom, top, where = [True, True, False, True, True],
+                    color = 'blue', alpha = 0.5)
 
     ax.set_ylim(0, ho1 + max(d1, d2) + 2)
-    ax.set_xlim(0, 3)
-    ax.set_xlabel("Horizontal distance")
-    ax.set_ylabel("Elevation")
-    ax.set_title("Channel Figure")
 
     return fig
 
@@ -97,96 +214,49 @@ channel_fig = plot_channel(ho, delta_h, d1, d2)
 st.pyplot(channel_fig)
 
 
-# Plot specific energy diagram
-def plot_specific_energy(df, d1, d2):
-    fig, ax = plt.subplots()
+# Plot specific energy diagram, reusing a persistent figure the same way
+@st.cache_resource
+def _specific_energy_fig():
+    from matplotlib.figure import Figure
+
+    fig = Figure()
+    ax = fig.add_subplot()
+    ax.set_xlabel("Depth (d)")
+    ax.set_ylabel("Specific Head (Ho)")
+    ax.set_title("Specific Head Diagram")
+    return fig, ax
+
+
+def plot_specific_energy(depths, Hos, q, d1, Ho1, d2, Ho2, d_c, H_c):
+    fig, ax = _specific_energy_fig()
+    for artist in list(ax.lines) + list(ax.collections) + list(ax.texts):
+        artist.remove()
 
-    ax.plot(df["Depth"], df["Specific Head"], label = "q = {:.2f}".format(q))
+    ax.plot(depths, Hos, label = "q = {:.2f}".format(q))
+    ax.axvline(d_c, color = "red", linestyle = "--", linewidth = 1)
+    ax.scatter(d_c, H_c, color = "black", label = "Critical")
+    ax.annotate("C", (d_c, H_c))
     ax.scatter(d1, Ho1, color = "red", label = "P1")
     ax.scatter(d2, Ho2, color = "green", label = "P2")
     ax.annotate("P1", (d1, Ho1))
     ax.annotate("P2", (d2, Ho2))
 
-    ax.set_xlabel("Depth (d)")
-    ax.set_ylabel("Specific Head (Ho)")
-    ax.set_title("Specific Head Diagram")
+    ax.relim()
+    ax.autoscale_view()
     ax.legend()
 
     return fig
 
-import plotly.graph_objects as go
-
-def plot_specific_energy_curve(specific_energy, critical_depth, sequent_depth):
-    fig = go.Figure()
-
-    # Add trace for specific energy curve
-    fig.add_trace(go.Scatter(
-        x=specific_energy['Depth'],
-        y=specific_energy['Specific Energy'],
-        name="Specific Energy",
-        mode="lines",
-        line=dict(color='blue')
-    ))
-
-    # Add trace for critical depth
-    fig.add_shape(
-        type='line',
-        x0=critical_depth,
-        x1=critical_depth,
-        y0=0,
-        y1=max(specific_energy['Specific Energy']),
-        yref='y',
-        xref='x',
-        line=dict(color='red', dash='dash'),
-        name="Critical Depth"
-    )
-    fig.add_trace(go.Scatter(
-        x=[critical_depth],
-        y=[specific_energy.loc[specific_energy['Depth'] == critical_depth]['Specific Energy'].values[0]],
-        text=[f"Critical Depth: {critical_depth:.2f}"],
-        mode="text",
-        showlegend=False
-    ))
-
-    # Add trace for sequent depth
-    fig.add_shape(
-        type='line',
-        x0=sequent_depth,
-        x1=sequent_depth,
-        y0=0,
-        y1=max(specific_energy['Specific Energy']),
-        yref='y',
-        xref='x',
-        line=dict(color='green', dash='dash'),
-        name="Sequent Depth"
-    )
-    fig.add_trace(go.Scatter(
-        x=[sequent_depth],
-        y=[specific_energy.loc[specific_energy['Depth'] == sequent_depth]['Specific Energy'].values[0]],
-        text=[f"Sequent Depth: {sequent_depth:.2f}"],
-        mode="text",
-        showlegend=False
-    ))
-
-    fig.update_layout(
-        title="Specific Energy Curve",
-        xaxis_title="Depth (ft)",
-        yaxis_title="Specific Energy (ft)"
-    )
-
-    st.plotly_chart(fig)
-
-
-
-specific_energy_fig = plot_specific_energy(df, d1, d2)
+specific_energy_fig = plot_specific_energy(depths, Hos, q, d1, Ho1, d2, Ho2, d_c, H_c)
 st.pyplot(specific_energy_fig)
 
-# Display flow parameters
-st.markdown("## Flow parameters")
-st.markdown(f"Depth of approaching flow: {d1:.2f}")
-st.markdown(f"Velocity of approaching flow: {U1:.2f}")
-st.markdown(f"Froude number of approaching flow: {Fr1:.2f}")
-st.markdown(f"Depth of downstream flow: {d2:.2f}")
-st.markdown(f"Velocity of downstream flow: {U2:.2f}")
-st.markdown(f"Froude number of downstream flow: {Fr2:.2f}")
+# Display flow parameters in one write instead of six separate
+# protocol messages
+st.markdown(f"""## Flow parameters
+
+| Parameter | Approaching | Downstream |
+|---|---|---|
+| Depth | {d1:.2f} | {d2:.2f} |
+| Velocity | {U1:.2f} | {U2:.2f} |
+| Froude number | {Fr1:.2f} | {Fr2:.2f} |""")
 